@@ -0,0 +1,180 @@
+import os
+import glob
+import json
+import hashlib
+import tempfile
+from datetime import datetime
+from typing import List, Optional, Dict
+from urllib.parse import quote
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Append-only Parquet archive of stored transactions, laid out as
+# ARCHIVE_DIR/upload_day=YYYY-MM-DD/bank=<bank>/part-<upload_id>.parquet
+ARCHIVE_DIR = os.getenv("TRANSACTION_ARCHIVE_DIR", "transaction_archive")
+# Leading underscore keeps the cache out of the dataset scan
+EXPORT_CACHE_DIR = os.path.join(ARCHIVE_DIR, "_exports")
+
+FILE_SCHEMA = pa.schema([
+    ("upload_id", pa.string()),
+    ("upload_date", pa.timestamp("us")),
+    ("transaction_id", pa.string()),
+    ("date", pa.string()),
+    ("amount", pa.float64()),
+    ("currency", pa.string()),
+    ("description", pa.string()),
+])
+PARTITION_SCHEMA = pa.schema([
+    ("upload_day", pa.string()),
+    ("bank", pa.string()),
+])
+ARCHIVE_SCHEMA = pa.schema(list(FILE_SCHEMA) + list(PARTITION_SCHEMA))
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+
+EXPORT_FORMATS = {"csv", "parquet", "xlsx"}
+
+os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+def _archive_files() -> List[str]:
+    return sorted(glob.glob(os.path.join(ARCHIVE_DIR, "upload_day=*", "bank=*", "*.parquet")))
+
+def archived_upload_ids() -> set:
+    return {os.path.basename(path)[len("part-"):-len(".parquet")] for path in _archive_files()}
+
+def archive_version() -> str:
+    """
+    Identifies the archive contents. Re-runs replace an upload's part file in place,
+    so each file's modification time and size are hashed along with its path.
+    """
+    entries = []
+    for path in _archive_files():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+    return hashlib.sha1("\n".join(entries).encode()).hexdigest()
+
+def append_transactions(upload_id: str, upload_date: datetime, transactions: List[Dict]):
+    """
+    Writes one Parquet file per bank for an upload and drops cached exports.
+    Parts from an earlier run of the same upload are removed, even when they sit in another
+    upload_day or bank partition, so a re-run replaces the upload instead of duplicating it.
+    """
+    stale_paths = set(glob.glob(os.path.join(ARCHIVE_DIR, "upload_day=*", "bank=*", f"part-{upload_id}.parquet")))
+    upload_day = upload_date.strftime("%Y-%m-%d")
+    by_bank: Dict[str, List[Dict]] = {}
+    for txn in transactions:
+        by_bank.setdefault(txn.get("bank") or "Unknown", []).append(txn)
+
+    for bank, rows in by_bank.items():
+        table = pa.Table.from_pydict({
+            "upload_id": [upload_id] * len(rows),
+            "upload_date": [upload_date] * len(rows),
+            "transaction_id": [row.get("transaction_id") for row in rows],
+            "date": [row.get("date") for row in rows],
+            "amount": [row.get("amount") for row in rows],
+            "currency": [row.get("currency") for row in rows],
+            "description": [row.get("description") for row in rows],
+        }, schema=FILE_SCHEMA)
+        partition_dir = os.path.join(ARCHIVE_DIR, f"upload_day={upload_day}", f"bank={quote(bank, safe='')}")
+        os.makedirs(partition_dir, exist_ok=True)
+        part_path = os.path.join(partition_dir, f"part-{upload_id}.parquet")
+        # Write under a dot-prefixed name so readers never see a half-written file
+        tmp_path = os.path.join(partition_dir, f".part-{upload_id}.parquet.tmp")
+        pq.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, part_path)
+        stale_paths.discard(part_path)
+
+    for path in stale_paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    if by_bank or stale_paths:
+        _clear_export_cache()
+
+def _clear_export_cache():
+    # Remove finished exports one by one; the directory and in-flight temp files stay,
+    # so a concurrent export_archive can still move its file into place
+    for path in glob.glob(os.path.join(EXPORT_CACHE_DIR, "transactions_*")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def query_archive(columns: Optional[List[str]] = None, start_date: Optional[str] = None, end_date: Optional[str] = None, bank: Optional[str] = None, limit: Optional[int] = None) -> pa.Table:
+    """
+    Reads archived transactions, pruning partitions by upload day (inclusive, YYYY-MM-DD) and bank.
+    With a limit, scanning stops as soon as enough rows are found.
+    Raises ValueError for unknown column names.
+    """
+    unknown = [c for c in columns or [] if c not in ARCHIVE_SCHEMA.names]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+    if not _archive_files():
+        empty = ARCHIVE_SCHEMA.empty_table()
+        return empty.select(columns) if columns else empty
+
+    condition = None
+    for expression in (
+        ds.field("upload_day") >= start_date if start_date else None,
+        ds.field("upload_day") <= end_date if end_date else None,
+        ds.field("bank") == bank if bank else None,
+    ):
+        if expression is not None:
+            condition = expression if condition is None else condition & expression
+
+    dataset = ds.dataset(ARCHIVE_DIR, schema=ARCHIVE_SCHEMA, format="parquet", partitioning=PARTITIONING)
+    if limit is not None:
+        return dataset.head(limit, columns=columns, filter=condition)
+    return dataset.to_table(columns=columns, filter=condition)
+
+def export_archive(export_format: str = "csv", columns: Optional[List[str]] = None, start_date: Optional[str] = None, end_date: Optional[str] = None, bank: Optional[str] = None) -> str:
+    """
+    Returns the path of an export file for the query, reusing a cached file when the archive is unchanged.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    cache_key = hashlib.sha1(json.dumps({
+        "version": archive_version(),
+        "format": export_format,
+        "columns": columns,
+        "start_date": start_date,
+        "end_date": end_date,
+        "bank": bank,
+    }, sort_keys=True).encode()).hexdigest()
+    export_path = os.path.join(EXPORT_CACHE_DIR, f"transactions_{cache_key}.{export_format}")
+    if os.path.exists(export_path):
+        return export_path
+
+    table = query_archive(columns, start_date, end_date, bank)
+    # Retry once if the cache directory disappeared between writing and moving the file
+    for attempt in range(2):
+        os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+        # Unique temp name per export; keep the extension since pandas picks the Excel writer from it
+        fd, tmp_path = tempfile.mkstemp(dir=EXPORT_CACHE_DIR, prefix=".tmp-", suffix=f".{export_format}")
+        os.close(fd)
+        try:
+            _write_export(table, export_format, tmp_path)
+            os.replace(tmp_path, export_path)
+            return export_path
+        except FileNotFoundError:
+            if attempt:
+                raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def _write_export(table: pa.Table, export_format: str, path: str):
+    if export_format == "parquet":
+        pq.write_table(table, path, compression="zstd")
+    elif export_format == "csv":
+        pa_csv.write_csv(table, path)
+    else:
+        table.to_pandas().to_excel(path, index=False, sheet_name="Extracted Data")
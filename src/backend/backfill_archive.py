@@ -0,0 +1,33 @@
+"""
+One-off backfill of the Parquet transaction archive from MongoDB.
+
+Uploads stored before the archive existed are only in the document store, so historical
+exports from /archive/export would miss them. Run once from the repository root:
+
+    python -m src.backend.backfill_archive
+
+Uploads that already have archive files are skipped, so the script is safe to re-run.
+"""
+import asyncio
+from fastapi.concurrency import run_in_threadpool
+from .database import batches_collection, transactions_collection
+from .archive import append_transactions, archived_upload_ids
+
+async def backfill_archive() -> int:
+    archived = archived_upload_ids()
+    backfilled = 0
+    async for batch in batches_collection.find({}, {"upload_id": 1, "upload_date": 1}):
+        upload_id = batch.get("upload_id")
+        if not upload_id or not batch.get("upload_date") or upload_id in archived:
+            continue
+        transactions = await transactions_collection.find({"upload_id": upload_id}).to_list(None)
+        if not transactions:
+            continue
+        await run_in_threadpool(append_transactions, upload_id, batch["upload_date"], transactions)
+        backfilled += 1
+        print(f"Archived {len(transactions)} transactions for upload {upload_id}")
+    return backfilled
+
+if __name__ == "__main__":
+    count = asyncio.run(backfill_archive())
+    print(f"Backfilled {count} uploads into the transaction archive.")
@@ -1,20 +1,168 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from .config import MONGO_URL, MONGO_DATABASE
+from pymongo import monitoring
+from pymongo.write_concern import WriteConcern
+from .config import (
+    MONGO_URL, MONGO_DATABASE, MONGO_PROFILE, MONGO_MIN_POOL_SIZE, MONGO_MAX_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_BULK_WRITE_W, MONGO_WRITE_TIMEOUT_MS,
+)
 from typing import List, Optional, Dict
 import datetime
+import threading
 
-client = AsyncIOMotorClient(MONGO_URL)
+class DatabaseStats(monitoring.ConnectionPoolListener, monitoring.CommandListener):
+    """
+    Collects connection pool wait and command latency figures from pymongo events.
+    Events arrive on driver threads, so every update is taken under a lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections_open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = {}
+        self.pool_wait_total_ms = 0.0
+        self.pool_wait_max_ms = 0.0
+        self.commands = {}
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            timed_checkouts = self.checkouts or 1
+            return {
+                "pool": {
+                    "connections_open": self.connections_open,
+                    "checked_out": self.checked_out,
+                    "checkouts": self.checkouts,
+                    "checkout_failures": dict(self.checkout_failures),
+                    "avg_wait_ms": round(self.pool_wait_total_ms / timed_checkouts, 3),
+                    "max_wait_ms": round(self.pool_wait_max_ms, 3),
+                },
+                "commands": {
+                    name: {
+                        "count": c["count"],
+                        "failed": c["failed"],
+                        "avg_ms": round(c["total_ms"] / (c["count"] or 1), 3),
+                        "max_ms": round(c["max_ms"], 3),
+                    }
+                    for name, c in self.commands.items()
+                },
+            }
+
+    def _record_command(self, event, failed: bool):
+        duration_ms = event.duration_micros / 1000.0
+        with self._lock:
+            c = self.commands.setdefault(event.command_name, {"count": 0, "failed": 0, "total_ms": 0.0, "max_ms": 0.0})
+            c["count"] += 1
+            c["failed"] += int(failed)
+            c["total_ms"] += duration_ms
+            c["max_ms"] = max(c["max_ms"], duration_ms)
+
+    # CommandListener
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record_command(event, failed=False)
+
+    def failed(self, event):
+        self._record_command(event, failed=True)
+
+    # ConnectionPoolListener
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+
+    def connection_checked_out(self, event):
+        # duration is only reported by pymongo >= 4.7
+        wait_ms = getattr(event, "duration", 0.0) * 1000.0
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.pool_wait_total_ms += wait_ms
+            self.pool_wait_max_ms = max(self.pool_wait_max_ms, wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+database_stats = DatabaseStats()
+
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    event_listeners=[database_stats],
+)
 db = client[MONGO_DATABASE]
 batches_collection = db["extraction_batches"]
 transactions_collection = db["extracted_transactions"]
+bulk_transactions_collection = transactions_collection.with_options(
+    write_concern=WriteConcern(w=MONGO_BULK_WRITE_W, wtimeout=MONGO_WRITE_TIMEOUT_MS)
+)
+
+def get_database_stats() -> Dict:
+    stats = database_stats.snapshot()
+    stats["settings"] = {
+        "profile": MONGO_PROFILE,
+        "min_pool_size": MONGO_MIN_POOL_SIZE,
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "server_selection_timeout_ms": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connect_timeout_ms": MONGO_CONNECT_TIMEOUT_MS,
+        "socket_timeout_ms": MONGO_SOCKET_TIMEOUT_MS,
+        "wait_queue_timeout_ms": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "bulk_write_w": MONGO_BULK_WRITE_W,
+        "write_timeout_ms": MONGO_WRITE_TIMEOUT_MS,
+    }
+    return stats
 
 async def create_extraction_batch(upload_id: str, upload_date: datetime, total_files: int):
-    await batches_collection.insert_one({
-        "upload_id": upload_id,
-        "upload_date": upload_date,
-        "total_files": total_files,
-        "extraction_summary": {}
-    })
+    # Upsert so a retried upload_id reuses its batch instead of inserting a second one
+    await batches_collection.update_one(
+        {"upload_id": upload_id},
+        {
+            "$set": {
+                "upload_id": upload_id,
+                "upload_date": upload_date,
+                "total_files": total_files,
+                "extraction_summary": {}
+            },
+            "$unset": {"rejected_files": ""},
+        },
+        upsert=True
+    )
+
+async def get_extraction_batch(upload_id: str) -> Optional[Dict]:
+    return await batches_collection.find_one({"upload_id": upload_id})
 
 async def store_extracted_data(upload_id: str, all_extracted_data: List[Dict], validation_errors: List[Dict]):
     total_amounts = {}
@@ -23,7 +171,6 @@ async def store_extracted_data(upload_id: str, all_extracted_data: List[Dict], v
 
     for transaction in all_extracted_data:
         transaction["upload_id"] = upload_id
-        await transactions_collection.insert_one(transaction)
         stored_transactions_count += 1
         if transaction.get("amount") is not None and isinstance(transaction["amount"], (int, float)):
             currency = transaction.get("currency", "UNKNOWN")
@@ -32,6 +179,12 @@ async def store_extracted_data(upload_id: str, all_extracted_data: List[Dict], v
         if transaction.get("info") and transaction["info"].get("missing_fields"):
             missing_info_count += 1
 
+    # A retried upload replaces whatever an earlier, interrupted run stored
+    await transactions_collection.delete_many({"upload_id": upload_id})
+    # One round trip for the whole batch instead of one insert per transaction
+    if all_extracted_data:
+        await bulk_transactions_collection.insert_many(all_extracted_data, ordered=False)
+
     await batches_collection.update_one(
         {"upload_id": upload_id},
         {"$set": {
@@ -82,4 +235,13 @@ async def store_zip_file_path(extract_id: str, zip_file_path: str):
     await batches_collection.update_one({"upload_id": extract_id}, {"$set": {"zip_file_path": zip_file_path}})
 
 async def store_report_file_path(extract_id: str, report_file_path: str):
-    await batches_collection.update_one({"upload_id": extract_id}, {"$set": {"report_file_path": report_file_path}})
\ No newline at end of file
+    await batches_collection.update_one({"upload_id": extract_id}, {"$set": {"report_file_path": report_file_path}})
+
+async def store_quality_rejections(upload_id: str, rejected_files: List[Dict]):
+    await batches_collection.update_one(
+        {"upload_id": upload_id},
+        {"$set": {
+            "rejected_files": rejected_files,
+            "extraction_summary.rejected_files_count": len(rejected_files),
+        }}
+    )
@@ -16,14 +16,17 @@ class Transaction(BaseModel):
     amount: Optional[float] = None
     currency: Optional[str] = None
     description: Optional[str] = None
+    bank: Optional[str] = None
     info: Optional[TransactionInfo] = None # Default to empty info
     # Add other transaction fields
 
 class ExtractionResult(BaseModel):
+    transaction_id: Optional[str] = None
     date: Optional[str] = None
     description: Optional[str] = None
     amount: Optional[float] = None
     currency: Optional[str] = None
+    bank: Optional[str] = None
     # Add other relevant fields that are part of the *initial* extraction
 
 class ValidationError(BaseModel):
@@ -38,6 +41,21 @@ class FileUploadResponse(BaseModel):
     total_amount: Optional[Dict[str, float]] = None  # <-- Accepts dict by currency
     missing_info_count: Optional[int] = None
     transaction_info: Optional[List[Dict]] = None
+    rejected_files: Optional[List[Dict]] = None  # Images skipped by the quality gate, with info.blur_reason
+
+class UploadAcceptedResponse(BaseModel):
+    upload_id: str
+    message: str
+    events_url: str
+    partial_results_url: str
+
+class PartialResultsResponse(BaseModel):
+    upload_id: str
+    stage: Optional[str] = None
+    done: bool
+    extracted_transactions: List[ExtractionResult]
+    validation_errors_count: int
+    rejected_files: Optional[List[Dict]] = None
 
 class ProcessingReportResponse(BaseModel):
     summary: Optional[Dict] = None
@@ -2,6 +2,43 @@ import cv2
 import numpy as np
 import os
 
+# Quality gate thresholds, tuned for the downsampled copy used by assess_image_quality.
+# Calibrated on the photos in data/raw: all readable receipts score >= 45 Laplacian variance
+# and >= 0.012 edge density; only the motion-blurred shots with smeared text score below 40.
+QUALITY_CHECK_MAX_SIDE = 800
+MIN_IMAGE_SIDE = 300
+MIN_LAPLACIAN_VARIANCE = 40.0
+MIN_TEXT_DENSITY = 0.008
+
+def assess_image_quality(image_path, rendered=False):
+    """
+    Cheap checks run before the 3x upscale and OCR, on a downsampled grayscale copy.
+    Returns a blur_reason string when the image cannot be read reliably, otherwise None.
+    Rendered PDF pages cannot be blurry and may be mostly white space, so for them
+    only readability and resolution are checked.
+    """
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return "unreadable image"
+    height, width = img.shape[:2]
+    if min(height, width) < MIN_IMAGE_SIDE:
+        return f"low resolution ({width}x{height})"
+    if rendered:
+        return None
+    scale = QUALITY_CHECK_MAX_SIDE / max(height, width)
+    if scale < 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    # Sharp text gives strong second derivatives; blur flattens them
+    sharpness = cv2.Laplacian(img, cv2.CV_64F).var()
+    if sharpness < MIN_LAPLACIAN_VARIANCE:
+        return f"blurry (laplacian variance {sharpness:.1f})"
+    # Fraction of edge pixels approximates how much of the image is text
+    edges = cv2.Canny(img, 50, 150)
+    text_density = np.count_nonzero(edges) / edges.size
+    if text_density < MIN_TEXT_DENSITY:
+        return f"no text detected (edge density {text_density:.3f})"
+    return None
+
 def preprocess_image(image_path):
     img = cv2.imread(image_path)
     
@@ -0,0 +1,82 @@
+import asyncio
+import json
+from typing import List, Optional, Dict
+
+# How many finished uploads to keep in memory for late subscribers and retries
+MAX_FINISHED_UPLOADS = 100
+# Seconds between SSE keep-alive comments while a long OCR stage is running
+KEEP_ALIVE_SECONDS = 15
+
+class UploadProgress:
+    """
+    In-memory event log and partial results for one upload.
+    Events are kept for the lifetime of the entry so reconnecting clients can resume with Last-Event-ID.
+    """
+    def __init__(self, upload_id: str):
+        self.upload_id = upload_id
+        self.events: List[Dict] = []
+        self.transactions: List[Dict] = []
+        self.rejected_files: List[Dict] = []
+        self.validation_errors_count = 0
+        self.result: Optional[Dict] = None
+        self.done = False
+        self._changed = asyncio.Condition()
+
+    @property
+    def stage(self) -> Optional[str]:
+        return self.events[-1]["stage"] if self.events else None
+
+    @property
+    def failed(self) -> bool:
+        return self.done and self.result is None
+
+    async def emit(self, stage: str, **data):
+        async with self._changed:
+            self.events.append({"id": len(self.events), "upload_id": self.upload_id, "stage": stage, **data})
+            if stage in ("completed", "failed"):
+                self.done = True
+            self._changed.notify_all()
+
+    async def wait_result(self) -> Optional[Dict]:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.done)
+        return self.result
+
+    async def stream(self, last_event_id: int = -1):
+        """Yields server-sent events after last_event_id until the upload completes or fails."""
+        next_id = last_event_id + 1
+        while True:
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(lambda: len(self.events) > next_id or self.done),
+                        timeout=KEEP_ALIVE_SECONDS,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                pending = self.events[next_id:]
+                finished = self.done
+            if not pending and not finished:
+                yield ": keep-alive\n\n"
+                continue
+            for event in pending:
+                yield f"id: {event['id']}\nevent: {event['stage']}\ndata: {json.dumps(event, default=str)}\n\n"
+            next_id += len(pending)
+            if finished:
+                return
+
+_uploads: Dict[str, UploadProgress] = {}
+
+def get_upload_progress(upload_id: str) -> Optional[UploadProgress]:
+    return _uploads.get(upload_id)
+
+def start_upload_progress(upload_id: str) -> UploadProgress:
+    """Registers a fresh entry for upload_id, replacing any earlier (failed) run."""
+    finished = [key for key, progress in _uploads.items() if progress.done]
+    # Dicts keep insertion order, so the first finished entries are the oldest
+    for key in finished[:max(0, len(finished) - MAX_FINISHED_UPLOADS + 1)]:
+        del _uploads[key]
+    progress = UploadProgress(upload_id)
+    _uploads.pop(upload_id, None)
+    _uploads[upload_id] = progress
+    return progress
@@ -1,11 +1,41 @@
 import re
+import hashlib
 from typing import List, Dict
 import pytesseract
 import numpy as np
+import pandas as pd
 from PIL import Image
 
 pytesseract.pytesseract.tesseract_cmd = r'/usr/local/bin/tesseract'  # adjust if needed
 
+# Row-level patterns for multi-transaction statements (named groups feed pandas str.extract)
+STATEMENT_DATE_PATTERN = (
+    r'(?P<transaction_date>'
+    r'(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?\s+\d{1,2},?\s+\d{4}'
+    r'(?:\s+\d{1,2}:\d{2}\s*(?:AM|PM))?'
+    r'|\d{1,2}[/-]\d{1,2}[/-]\d{2,4})'
+)
+# Currency-tagged amounts may omit decimals (e.g. whole riel), like the ABA receipt parser allows
+STATEMENT_TAGGED_AMOUNT_PATTERN = (
+    r'(?P<amount>(?<![\d.,])-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d{2})?)'
+    r'\s*(?P<currency>USD|KHR|[UK](?![A-Za-z]))'
+)
+# Untagged amounts need decimals so dates, years and reference numbers are not read as amounts
+STATEMENT_DECIMAL_AMOUNT_PATTERN = r'(?P<amount>(?<![\d.,])-?(?:\d{1,3}(?:,\d{3})+|\d+)\.\d{2})'
+# Header words that label the columns of a statement table; the header row is the row with the most of them
+STATEMENT_HEADER_WORD_PATTERN = (
+    r'(?:Trx\.?|Txn\.?|Ref\.?|Reference|ID|លេខកូដ\S*'
+    r'|Amount|Debit|Credit|Withdrawals?|Deposits?|Balance)'
+)
+# Header cells (adjacent header words joined, e.g. "Money In") are classified in this order
+STATEMENT_BALANCE_HEADER_PATTERN = r'\bBalance\b'
+STATEMENT_AMOUNT_HEADER_PATTERN = r'\b(?:Amount|Debit|Credit|Withdrawals?|Deposits?|(?:Money|Paid)\s+(?:In|Out))\b'
+STATEMENT_ID_HEADER_PATTERN = r'(?:\b(?:Trx|Txn|Ref|Reference|ID)\b|លេខកូដ)'
+STATEMENT_ID_VALUE_PATTERN = r'(?=\S*\d)[A-Za-z0-9-]{6,}'
+# Inside an amount column decimals are optional (whole riel); currency tags follow a number on the row
+STATEMENT_COLUMN_AMOUNT_PATTERN = r'-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d{2})?'
+STATEMENT_ROW_CURRENCY_PATTERN = r'\d\s*(USD|KHR|[UK](?![A-Za-z]))'
+
 def extract_data_aba(image: np.ndarray, debug: bool=False) -> List[Dict]:
     extracted_transactions = []
     try:
@@ -89,6 +119,146 @@ def extract_data_aba(image: np.ndarray, debug: bool=False) -> List[Dict]:
     return extracted_transactions
 
 
+def _ocr_words(image: np.ndarray, lang: str, config: str) -> pd.DataFrame:
+    """
+    Runs Tesseract once and returns the recognised words with their boxes.
+    Output.DICT is used instead of Output.DATAFRAME so numeric-looking words stay strings.
+    """
+    data = pytesseract.image_to_data(Image.fromarray(image), lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    words = pd.DataFrame(data)
+    words["text"] = words["text"].astype(str).str.strip()
+    words["conf"] = pd.to_numeric(words["conf"], errors="coerce")
+    return words[(words["conf"] >= 0) & (words["text"] != "")]
+
+
+def _assign_rows(words: pd.DataFrame) -> pd.DataFrame:
+    """
+    Labels each word with a table row, grouping words by their vertical centre.
+    A new row starts whenever the gap to the previous word centre exceeds half a word height.
+    """
+    words = words.assign(center=words["top"] + words["height"] / 2).sort_values("center")
+    tolerance = max(words["height"].median() * 0.5, 1.0)
+    words["row"] = (words["center"].diff() > tolerance).cumsum()
+    return words.sort_values(["row", "left"])
+
+
+def _assign_columns(words: pd.DataFrame) -> pd.Series:
+    """
+    Labels each word below the statement table header with the kind of its column:
+    "id", "amount", "balance" or None, indexed like words. Words above the header get None.
+
+    Adjacent header words are joined into one header cell, and every word is assigned to the
+    header cell with the nearest horizontal centre that it overlaps.
+    """
+    kinds = pd.Series(None, index=words.index, dtype=object)
+    is_header_word = words["text"].str.fullmatch(STATEMENT_HEADER_WORD_PATTERN, case=False)
+    if not is_header_word.any():
+        return kinds
+    header_row = is_header_word.groupby(words["row"]).sum().idxmax()
+    header = words[words["row"] == header_row].assign(right=lambda w: w["left"] + w["width"])
+    # Words further apart than a word height belong to different header cells
+    cell = ((header["left"] - header["right"].shift()) > header["height"].median()).cumsum()
+    cells = header.groupby(cell).agg(left=("left", "min"), right=("right", "max"), text=("text", " ".join))
+    cell_kinds = np.select(
+        [
+            cells["text"].str.contains(STATEMENT_BALANCE_HEADER_PATTERN, case=False),
+            cells["text"].str.contains(STATEMENT_AMOUNT_HEADER_PATTERN, case=False),
+            cells["text"].str.contains(STATEMENT_ID_HEADER_PATTERN, case=False),
+        ],
+        ["balance", "amount", "id"],
+        default=None,
+    )
+
+    body = words[words["row"] > header_row]
+    cell_centers = ((cells["left"] + cells["right"]) / 2).to_numpy()
+    word_centers = (body["left"] + body["width"] / 2).to_numpy()
+    nearest = np.abs(word_centers[:, None] - cell_centers[None, :]).argmin(axis=1)
+    # The word must also overlap its cell (widened by a word height), so text far from any header stays unlabelled
+    margin = header["height"].median()
+    overlaps = (body["left"].to_numpy() < cells["right"].to_numpy()[nearest] + margin) & \
+               (body["left"].to_numpy() + body["width"].to_numpy() > cells["left"].to_numpy()[nearest] - margin)
+    kinds[body.index] = np.where(overlaps, cell_kinds[nearest], None)
+    return kinds
+
+
+def extract_data_statement(image: np.ndarray, lang: str = 'khm+eng', debug: bool = False, page: int = None) -> List[Dict]:
+    """
+    Extracts every transaction row from a multi-row account statement page.
+
+    Uses Tesseract word boxes to rebuild table rows, then parses all rows at once
+    with pandas string operations. A row is kept when it has both a date and an amount.
+    When the table header names Amount/Debit/Credit columns, amounts are read only from
+    those columns so the Balance column is never taken as the transaction amount.
+    Transaction IDs come from the column under the ID header; rows without one get a
+    stable "STMT-" ID hashed from the page, row position and row text.
+    Rows without an explicit currency use the page currency only when the page shows exactly one.
+    """
+    extracted_transactions = []
+    try:
+        custom_config = r'--oem 3 --psm 6'
+        words = _ocr_words(image, lang, custom_config)
+        if words.empty:
+            print("Could not find any words on statement page.")
+            return extracted_transactions
+
+        words = _assign_rows(words)
+        lines = words.groupby("row")["text"].agg(" ".join)
+        columns = _assign_columns(words)
+        if (columns == "amount").any():
+            # Amounts only from the Amount/Debit/Credit columns, never from the running balance
+            in_amount_column = (columns == "amount") & words["text"].str.fullmatch(STATEMENT_COLUMN_AMOUNT_PATTERN)
+            amounts = pd.DataFrame({
+                "amount": words[in_amount_column].groupby("row")["text"].first(),
+                "currency": lines.str.extract(STATEMENT_ROW_CURRENCY_PATTERN, flags=re.IGNORECASE)[0],
+            })
+        else:
+            # No recognised table header: fall back to the amount pattern on the whole row
+            tagged = lines.str.extract(STATEMENT_TAGGED_AMOUNT_PATTERN, flags=re.IGNORECASE)
+            untagged = lines.str.extract(STATEMENT_DECIMAL_AMOUNT_PATTERN, flags=re.IGNORECASE)
+            amounts = tagged.combine_first(untagged)
+        is_id = (columns == "id") & words["text"].str.fullmatch(STATEMENT_ID_VALUE_PATTERN)
+        rows = pd.concat([
+            lines.rename("line"),
+            lines.str.extract(STATEMENT_DATE_PATTERN, flags=re.IGNORECASE),
+            amounts,
+            words[is_id].groupby("row")["text"].first().rename("transaction_id"),
+        ], axis=1)
+
+        page_currencies = lines.str.extract(r'\b(USD|KHR)\b', flags=re.IGNORECASE)[0].dropna().str.upper().unique()
+        rows = rows.dropna(subset=["transaction_date", "amount"])
+        if rows.empty:
+            print(f"Could not extract any transactions from statement (OCR rows):\n{' | '.join(lines.head(5))}...")
+            return extracted_transactions
+
+        amounts = pd.to_numeric(rows["amount"].str.replace(",", "", regex=False), errors="coerce").abs()
+        currency = rows["currency"].str.upper().replace({"U": "USD", "K": "KHR"})
+        if len(page_currencies) == 1:
+            currency = currency.fillna(page_currencies[0])
+
+        fallback_ids = pd.Series(
+            ["STMT-" + hashlib.sha1(f"{page}:{row}:{line}".encode()).hexdigest()[:12].upper() for row, line in rows["line"].items()],
+            index=rows.index,
+        )
+        transactions = pd.DataFrame({
+            "transaction_id": rows["transaction_id"].fillna(fallback_ids),
+            "transaction_date": rows["transaction_date"].str.strip(),
+            "amount_usd": amounts.where(currency == "USD"),
+            "amount_khr": amounts.where(currency == "KHR"),
+            "description": rows["line"],
+        })
+        transactions = transactions.astype(object).where(transactions.notna(), None)
+        extracted_transactions = transactions.to_dict("records")
+        if debug:
+            print(f"Extracted {len(extracted_transactions)} statement rows from {len(lines)} OCR rows.")
+
+    except pytesseract.TesseractError as e:
+        print(f"Tesseract OCR error (statement): {e}")
+    except Exception as e:
+        print(f"Error during OCR or extraction (statement): {e}")
+
+    return extracted_transactions
+
+
 def extract_data_aclida(image: np.ndarray) -> List[Dict]:
     extracted_transactions = []
     try:
@@ -139,7 +309,9 @@ def extract_data_aclida(image: np.ndarray) -> List[Dict]:
 
     return extracted_transactions
 
-def extract_data(image: np.ndarray, bank_name: str = None, debug: bool = False) -> List[Dict]:
+def extract_data(image: np.ndarray, bank_name: str = None, debug: bool = False, statement: bool = False, page: int = None) -> List[Dict]:
+    if statement:
+        return extract_data_statement(image, lang='khm+eng' if bank_name == "ABA Bank" else 'eng', debug=debug, page=page)
     if bank_name == "ABA Bank":
         return extract_data_aba(image, debug)
     elif bank_name == "ACLEDA Bank":
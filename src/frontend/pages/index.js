@@ -14,11 +14,14 @@ export default function Home() {
   const [uploadStatus, setUploadStatus] = useState('idle');
   const [results, setResults] = useState(null);
   const [errorMessage, setErrorMessage] = useState('');
+  // One upload_id per file selection, so retrying after a dropped connection reuses the server's run
+  const uploadIdRef = useRef(null);
 
   const handleFileChange = (event) => {
     const newFiles = Array.from(event.target.files);
     setFiles(newFiles);
     setSelectedFiles(newFiles);
+    uploadIdRef.current = null;
   };
 
   const handleDrop = (event) => {
@@ -26,6 +29,7 @@ export default function Home() {
     const newFiles = Array.from(event.dataTransfer.files);
     setFiles(newFiles);
     setSelectedFiles(newFiles);
+    uploadIdRef.current = null;
   };
 
   const handleDragOver = (event) => {
@@ -49,7 +53,11 @@ export default function Home() {
     setErrorMessage('');
     setResults(null);
 
+    if (!uploadIdRef.current) {
+      uploadIdRef.current = crypto.randomUUID();
+    }
     const formData = new FormData();
+    formData.append('upload_id', uploadIdRef.current);
     files.forEach((file) => {
       formData.append('files', file);
     });
@@ -62,6 +70,7 @@ export default function Home() {
 
       if (response.ok) {
         const data = await response.json();
+        uploadIdRef.current = null;
         setUploadStatus('success');
         setUploadMessage(data.message);
         // Fetch results immediately after successful upload
@@ -1,9 +1,10 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, Header, Query, UploadFile, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
-from typing import List
+from typing import List, Optional
 import uuid
-from datetime import datetime
+from datetime import datetime, date
 import zipfile
 import os
 import json
@@ -14,13 +15,15 @@ import numpy as np
 from io import BytesIO
 import pandas as pd
 
-from .backend.database import create_extraction_batch, store_extracted_data, get_extraction_results, get_all_extraction_batches, store_zip_file_path, store_report_file_path, get_transactions_by_upload_id
-from .backend.models import FileUploadResponse, ExtractionResult, ValidationError, ProcessingReportResponse, HistoryItem, Transaction
+from .backend.database import create_extraction_batch, store_extracted_data, get_extraction_results, get_all_extraction_batches, store_zip_file_path, store_report_file_path, get_transactions_by_upload_id, store_quality_rejections, get_database_stats, get_extraction_batch
+from .backend.models import FileUploadResponse, ExtractionResult, ValidationError, ProcessingReportResponse, HistoryItem, Transaction, TransactionInfo, UploadAcceptedResponse, PartialResultsResponse
 from .backend.bank_classifier import classify_bank as classify_bank_module
-from .backend.preprocess import preprocess_image, preprocess_image_advanced
+from .backend.preprocess import preprocess_image, preprocess_image_advanced, assess_image_quality
 from .extraction.extract_data import extract_data as extract_data_module
 from .extraction.validation import validate_data as validate_data_module
 from .backend.routes import router
+from .backend.progress import UploadProgress, get_upload_progress, start_upload_progress
+from .backend.archive import append_transactions, query_archive, export_archive
 from .extraction.extract_data import extract_data_aba
 
 app = FastAPI(
@@ -49,19 +52,25 @@ app.add_middleware(
 
 async def classify_bank(image_path: str) -> str:
     try:
-        bank_name = classify_bank_module(image_path)
+        bank_name = await run_in_threadpool(classify_bank_module, image_path)
         return bank_name
     except Exception as e:
         print(f"Error classifying bank: {e}")
         return None
 
-async def extract_data(image: np.ndarray, bank_name: str = None, debug: bool = False) -> List[dict]:
+async def extract_data(image: np.ndarray, bank_name: str = None, debug: bool = False, statement: bool = False, page: int = None) -> List[dict]:
     try:
-        # Pass debug flag to extraction for ABA
-        if bank_name == "ABA Bank":
-            extracted_transactions = extract_data_aba(image, debug=debug)
-        else:
-            extracted_transactions = extract_data_module(image, bank_name)
+        extracted_transactions = []
+        # Statement pages carry many rows, so parse every row instead of the first match
+        if statement:
+            extracted_transactions = await run_in_threadpool(extract_data_module, image, bank_name, debug=debug, statement=True, page=page)
+        # Single-receipt pages (and PDFs of one receipt) have no table rows; use the receipt parsers
+        if not extracted_transactions:
+            # Pass debug flag to extraction for ABA
+            if bank_name == "ABA Bank":
+                extracted_transactions = await run_in_threadpool(extract_data_aba, image, debug=debug)
+            else:
+                extracted_transactions = await run_in_threadpool(extract_data_module, image, bank_name)
         # Normalize output to always have 'amount' and 'currency'
         normalized = []
         for txn in extracted_transactions:
@@ -78,7 +87,8 @@ async def extract_data(image: np.ndarray, bank_name: str = None, debug: bool = F
                 "date": txn.get("transaction_date"),
                 "amount": amount,
                 "currency": currency,
-                # Optionally include other fields if needed
+                "description": txn.get("description"),
+                "bank": bank_name,
             })
         return normalized
     except Exception as e:
@@ -93,77 +103,52 @@ async def validate_data(extracted_transactions: List[dict]) -> tuple[List[Extrac
         print(f"Error during data validation: {e}")
         return [], []
 
+def quality_rejection(file_name: str, blur_reason: str, page: int = None) -> dict:
+    print(f"Skipping {file_name}" + (f" (page {page})" if page else "") + f": {blur_reason}")
+    return {
+        "file_name": file_name,
+        "page": page,
+        "info": TransactionInfo(blur_reason=blur_reason).model_dump(exclude_none=True),
+    }
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Bank Transaction Scanner API!"}
 
-@app.post("/upload", response_model=FileUploadResponse)
-async def upload_file(files: List[UploadFile] = File(...)):
-    upload_id = str(uuid.uuid4())
-    upload_date = datetime.now()
-    total_files = len(files)
-    await create_extraction_batch(upload_id, upload_date, total_files)
-    extracted_data_all = []
-    validation_errors_all = []
-
+async def save_upload_files(upload_id: str, files: List[UploadFile], progress: UploadProgress) -> List[dict]:
+    """
+    Writes the uploaded files to disk so they can be processed after the request body is gone.
+    """
+    saved_files = []
     for file in files:
-        file_type = file.content_type
-        file_name = file.filename
-        upload_file_path = os.path.join(TEMP_UPLOAD_DIR, file_name)
-
+        upload_file_path = os.path.join(TEMP_UPLOAD_DIR, f"{upload_id}_{file.filename}")
         try:
             with open(upload_file_path, "wb") as f:
                 content = await file.read()
                 f.write(content)
-
-            bank_name = None
-            processed_image = None
-
-            if "image" in file_type:
-                # Use advanced preprocessing for robust handling
-                processed_image = preprocess_image_advanced(upload_file_path, debug=True)  # Enable debug
-                bank_name = await classify_bank(upload_file_path)
-                print(f"Classified bank for {file_name}: {bank_name}")
-                extracted_transactions = await extract_data(processed_image, bank_name, debug=True)  # Enable debug
-                valid_transactions, errors = await validate_data(extracted_transactions)
-                extracted_data_all.extend(valid_transactions)
-                validation_errors_all.extend(errors)
-
-            elif file_type == "application/pdf":
-                try:
-                    images_from_pdf = convert_from_path(upload_file_path)
-                    print(f"Converted PDF {file_name} to {len(images_from_pdf)} images.")
-                    for i, image in enumerate(images_from_pdf):
-                        intermediate_image_name = f"{file_name}_page_{i+1}.png"
-                        intermediate_image_path = os.path.join(TEMP_PROCESS_DIR, intermediate_image_name)
-                        image.save(intermediate_image_path, 'PNG')
-                        preprocessed_image = preprocess_image_advanced(intermediate_image_path)
-                        if i == 0:
-                            bank_name = await classify_bank(intermediate_image_path)
-                            print(f"Classified bank for PDF {file_name} (page 1): {bank_name}")
-                        extracted_transactions = await extract_data(preprocessed_image, bank_name)
-                        valid_transactions, errors = await validate_data(extracted_transactions)
-                        extracted_data_all.extend(valid_transactions)
-                        validation_errors_all.extend(errors)
-                        os.remove(intermediate_image_path)
-                except Exception as e:
-                    print(f"Error processing PDF {file_name}: {e}")
-            else:
-                print(f"Unsupported file type: {file_type} for {file_name}")
-                continue
-
+            saved_files.append({"file_name": file.filename, "file_type": file.content_type, "path": upload_file_path})
+            await progress.emit("file_received", file_name=file.filename, size=len(content))
         except Exception as e:
-            print(f"Error processing file {file_name}: {e}")
-        finally:
-            if os.path.exists(upload_file_path):
-                os.remove(upload_file_path)
+            print(f"Error saving file {file.filename}: {e}")
+    return saved_files
 
-    # Convert ExtractionResult and ValidationError objects to dictionaries before storing
-    serialized_extracted_data = [item.model_dump() for item in extracted_data_all]
-    serialized_validation_errors = [item.model_dump() for item in validation_errors_all]
+async def record_page_results(progress: UploadProgress, file_name: str, page: int, valid_transactions: List[ExtractionResult], errors: List[ValidationError]):
+    progress.transactions.extend(item.model_dump() for item in valid_transactions)
+    progress.validation_errors_count += len(errors)
+    await progress.emit("transactions_extracted", file_name=file_name, page=page, valid=len(valid_transactions), invalid=len(errors))
 
-    await store_extracted_data(upload_id, serialized_extracted_data, serialized_validation_errors)
+def parse_upload_id(upload_id: Optional[str]) -> Optional[str]:
+    """
+    Client-supplied upload IDs end up in file names, so only canonical UUIDs are accepted.
+    """
+    if upload_id is None:
+        return None
+    try:
+        return str(uuid.UUID(upload_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="upload_id must be a UUID")
 
+async def build_upload_response(upload_id: str, upload_date: datetime, total_files: int, rejected_files: List[dict]) -> dict:
     # Fetch the extraction results to include in the response
     results = await get_extraction_results(upload_id)
     summary = results.get("summary", {})
@@ -188,7 +173,217 @@ async def upload_file(files: List[UploadFile] = File(...)):
         "total_files": total_files,
         "total_amount": summary.get("total_amount"),
         "missing_info_count": summary.get("missing_info_count"),
-        "transaction_info": transaction_info_list[:5] # Limit to a few for the response
+        "transaction_info": transaction_info_list[:5], # Limit to a few for the response
+        "rejected_files": rejected_files,
+    }
+
+async def load_stored_upload(upload_id: str) -> Optional[UploadProgress]:
+    """
+    Rebuilds a finished upload's progress entry from MongoDB, so retries after an eviction
+    or a restart return the stored result instead of running OCR again.
+    """
+    batch = await get_extraction_batch(upload_id)
+    if not batch or "total_transactions" not in batch.get("extraction_summary", {}):
+        return None
+    rejected_files = batch.get("rejected_files", [])
+    result = await build_upload_response(upload_id, batch.get("upload_date"), batch.get("total_files"), rejected_files)
+    transactions = [ExtractionResult(**t).model_dump() for t in await get_transactions_by_upload_id(upload_id)]
+    # Another request may have registered this upload while we were reading
+    current = get_upload_progress(upload_id)
+    if current and not current.failed:
+        return current
+    progress = start_upload_progress(upload_id)
+    progress.rejected_files = rejected_files
+    progress.transactions = transactions
+    progress.result = result
+    await progress.emit("completed", total_amount=result["total_amount"], restored=True)
+    return progress
+
+async def find_upload(upload_id: str) -> Optional[UploadProgress]:
+    """
+    Returns the running or finished run for upload_id, or None if it has to be processed.
+    Failed runs are ignored so that a retry can start over.
+    """
+    existing = get_upload_progress(upload_id)
+    if existing and not existing.failed:
+        return existing
+    stored = await load_stored_upload(upload_id)
+    if stored:
+        return stored
+    # Another request may have started this upload while MongoDB was being checked;
+    # callers register a new run right after this returns, with no await in between
+    current = get_upload_progress(upload_id)
+    return current if current and not current.failed else None
+
+async def process_upload(upload_id: str, upload_date: datetime, total_files: int, saved_files: List[dict], progress: UploadProgress) -> dict:
+    """
+    Runs the OCR pipeline over the saved files, reporting each stage to the upload's progress stream.
+    """
+    try:
+        await create_extraction_batch(upload_id, upload_date, total_files)
+        extracted_data_all = []
+        validation_errors_all = []
+        rejected_files_all = progress.rejected_files
+
+        for saved_file in saved_files:
+            file_type = saved_file["file_type"]
+            file_name = saved_file["file_name"]
+            upload_file_path = saved_file["path"]
+
+            try:
+                bank_name = None
+                processed_image = None
+
+                if "image" in file_type:
+                    # Reject unreadable images before paying for upscaling and OCR
+                    blur_reason = await run_in_threadpool(assess_image_quality, upload_file_path)
+                    if blur_reason:
+                        rejected_files_all.append(quality_rejection(file_name, blur_reason))
+                        await progress.emit("quality_rejected", file_name=file_name, blur_reason=blur_reason)
+                        continue
+                    # Use advanced preprocessing for robust handling
+                    processed_image = await run_in_threadpool(preprocess_image_advanced, upload_file_path, debug=True)  # Enable debug
+                    bank_name = await classify_bank(upload_file_path)
+                    print(f"Classified bank for {file_name}: {bank_name}")
+                    await progress.emit("bank_classified", file_name=file_name, bank=bank_name)
+                    extracted_transactions = await extract_data(processed_image, bank_name, debug=True)  # Enable debug
+                    valid_transactions, errors = await validate_data(extracted_transactions)
+                    extracted_data_all.extend(valid_transactions)
+                    validation_errors_all.extend(errors)
+                    await record_page_results(progress, file_name, None, valid_transactions, errors)
+
+                elif file_type == "application/pdf":
+                    try:
+                        images_from_pdf = await run_in_threadpool(convert_from_path, upload_file_path)
+                        print(f"Converted PDF {file_name} to {len(images_from_pdf)} images.")
+                        for i, image in enumerate(images_from_pdf):
+                            intermediate_image_name = f"{os.path.basename(upload_file_path)}_page_{i+1}.png"
+                            intermediate_image_path = os.path.join(TEMP_PROCESS_DIR, intermediate_image_name)
+                            image.save(intermediate_image_path, 'PNG')
+                            await progress.emit("page_rasterised", file_name=file_name, page=i+1, total_pages=len(images_from_pdf))
+                            blur_reason = await run_in_threadpool(assess_image_quality, intermediate_image_path, rendered=True)
+                            if blur_reason:
+                                rejected_files_all.append(quality_rejection(file_name, blur_reason, page=i+1))
+                                await progress.emit("quality_rejected", file_name=file_name, page=i+1, blur_reason=blur_reason)
+                                os.remove(intermediate_image_path)
+                                continue
+                            preprocessed_image = await run_in_threadpool(preprocess_image_advanced, intermediate_image_path)
+                            if bank_name is None:
+                                bank_name = await classify_bank(intermediate_image_path)
+                                print(f"Classified bank for PDF {file_name} (page {i+1}): {bank_name}")
+                                await progress.emit("bank_classified", file_name=file_name, page=i+1, bank=bank_name)
+                            extracted_transactions = await extract_data(preprocessed_image, bank_name, statement=True, page=i+1)
+                            valid_transactions, errors = await validate_data(extracted_transactions)
+                            extracted_data_all.extend(valid_transactions)
+                            validation_errors_all.extend(errors)
+                            await record_page_results(progress, file_name, i+1, valid_transactions, errors)
+                            os.remove(intermediate_image_path)
+                    except Exception as e:
+                        print(f"Error processing PDF {file_name}: {e}")
+                else:
+                    print(f"Unsupported file type: {file_type} for {file_name}")
+                    continue
+
+            except Exception as e:
+                print(f"Error processing file {file_name}: {e}")
+            finally:
+                if os.path.exists(upload_file_path):
+                    os.remove(upload_file_path)
+
+        # Convert ExtractionResult and ValidationError objects to dictionaries before storing
+        serialized_extracted_data = [item.model_dump() for item in extracted_data_all]
+        serialized_validation_errors = [item.model_dump() for item in validation_errors_all]
+
+        await store_extracted_data(upload_id, serialized_extracted_data, serialized_validation_errors)
+        try:
+            await run_in_threadpool(append_transactions, upload_id, upload_date, serialized_extracted_data)
+        except Exception as e:
+            # MongoDB stays the source of truth; a failed archive write only affects analytics exports
+            print(f"Error archiving transactions for {upload_id}: {e}")
+        if rejected_files_all:
+            await store_quality_rejections(upload_id, rejected_files_all)
+        await progress.emit("stored", total_transactions=len(serialized_extracted_data))
+
+        progress.result = await build_upload_response(upload_id, upload_date, total_files, rejected_files_all)
+        await progress.emit("completed", total_amount=progress.result["total_amount"])
+        return progress.result
+    except Exception as e:
+        print(f"Error processing upload {upload_id}: {e}")
+        await progress.emit("failed", error=str(e))
+        raise
+
+@app.post("/upload", response_model=FileUploadResponse)
+async def upload_file(files: List[UploadFile] = File(...), upload_id: Optional[str] = Form(None)):
+    """
+    Processes the files and returns once everything is stored.
+    Clients may pass their own upload_id to follow /upload/{upload_id}/events while waiting;
+    a retry with the same upload_id waits for (or returns) the original run instead of repeating the OCR.
+    """
+    upload_id = parse_upload_id(upload_id)
+    while upload_id:
+        existing = await find_upload(upload_id)
+        if not existing:
+            break
+        result = await existing.wait_result()
+        if result is not None:
+            return result
+        # The run we waited on failed; look again in case another retry already restarted it
+
+    upload_id = upload_id or str(uuid.uuid4())
+    progress = start_upload_progress(upload_id)
+    upload_date = datetime.now()
+    saved_files = await save_upload_files(upload_id, files, progress)
+    return await process_upload(upload_id, upload_date, len(files), saved_files, progress)
+
+@app.post("/upload/async", response_model=UploadAcceptedResponse, status_code=202)
+async def upload_file_async(background_tasks: BackgroundTasks, files: List[UploadFile] = File(...), upload_id: Optional[str] = Form(None)):
+    """
+    Accepts the files and processes them in the background.
+    Progress is streamed from the events URL and partial results are available before the batch finishes.
+    """
+    upload_id = parse_upload_id(upload_id)
+    if upload_id and await find_upload(upload_id):
+        message = "Upload already accepted."
+    else:
+        upload_id = upload_id or str(uuid.uuid4())
+        progress = start_upload_progress(upload_id)
+        upload_date = datetime.now()
+        saved_files = await save_upload_files(upload_id, files, progress)
+        background_tasks.add_task(process_upload, upload_id, upload_date, len(files), saved_files, progress)
+        message = "Files accepted for processing."
+    return {
+        "upload_id": upload_id,
+        "message": message,
+        "events_url": f"/upload/{upload_id}/events",
+        "partial_results_url": f"/upload/{upload_id}/partial",
+    }
+
+@app.get("/upload/{upload_id}/events")
+async def stream_upload_events(upload_id: str, last_event_id: Optional[int] = Header(None, alias="Last-Event-ID")):
+    """
+    Server-sent event stream of processing stages for an upload.
+    """
+    progress = await find_upload(upload_id) or get_upload_progress(upload_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="No upload in progress for this upload ID")
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(progress.stream(-1 if last_event_id is None else last_event_id), media_type="text/event-stream", headers=headers)
+
+@app.get("/upload/{upload_id}/partial", response_model=PartialResultsResponse)
+async def read_partial_results(upload_id: str):
+    """
+    Transactions validated so far for an upload, available before the batch is stored.
+    """
+    progress = await find_upload(upload_id) or get_upload_progress(upload_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="No upload in progress for this upload ID")
+    return {
+        "upload_id": upload_id,
+        "stage": progress.stage,
+        "done": progress.done,
+        "extracted_transactions": progress.transactions,
+        "validation_errors_count": progress.validation_errors_count,
+        "rejected_files": progress.rejected_files,
     }
 
 @app.get("/results/{upload_id}", response_model=ProcessingReportResponse)
@@ -214,6 +409,13 @@ async def get_history():
     history_data = await get_all_extraction_batches()
     return history_data
 
+@app.get("/stats/database")
+async def read_database_stats():
+    """
+    Returns MongoDB pool settings, pool wait times and per-command latencies.
+    """
+    return get_database_stats()
+
 @app.get("/transactions/{upload_id}", response_model=List[Transaction])
 async def read_transactions(upload_id: str):
     """
@@ -284,4 +486,52 @@ async def download_csv(extract_id: str):
     }
     return StreamingResponse(csv_file, headers=headers)
 
+def parse_archive_columns(columns: Optional[str]) -> Optional[List[str]]:
+    return [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+
+@app.get("/archive/transactions")
+async def read_archived_transactions(
+    columns: Optional[str] = Query(None, description="Comma-separated column names"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    bank: Optional[str] = None,
+    limit: int = Query(1000, ge=1),
+):
+    """
+    Queries the Parquet transaction archive by upload date range and bank.
+    """
+    try:
+        table = await run_in_threadpool(
+            query_archive, parse_archive_columns(columns),
+            start_date.isoformat() if start_date else None, end_date.isoformat() if end_date else None, bank, limit,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content=json.loads(json.dumps(table.to_pylist(), default=str)))
+
+@app.get("/archive/export")
+async def download_archive_export(
+    export_format: str = Query("csv", alias="format", description="csv, xlsx or parquet"),
+    columns: Optional[str] = Query(None, description="Comma-separated column names"),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    bank: Optional[str] = None,
+):
+    """
+    Exports archived transactions; repeated identical exports are served from cache until new data is archived.
+    """
+    try:
+        export_path = await run_in_threadpool(
+            export_archive, export_format, parse_archive_columns(columns),
+            start_date.isoformat() if start_date else None, end_date.isoformat() if end_date else None, bank,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_types = {
+        "csv": "text/csv; charset=utf-8",
+        "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "parquet": "application/vnd.apache.parquet",
+    }
+    return FileResponse(path=export_path, filename=f"transactions_export.{export_format}", media_type=media_types[export_format])
+
 app.include_router(router)
\ No newline at end of file